@@ -1,45 +1,322 @@
 from __future__ import annotations
 
 import os
+import asyncio
+import itertools
 import base64
+import bisect
+import functools
+import hashlib
 import json
-import time
 import logging
+import mmap
+import string
+import threading
+import uuid
 import folder_paths
-import glob
 import comfy.utils
 import aiohttp
 from aiohttp import web
 from PIL import Image
 from io import BytesIO
-from folder_paths import map_legacy, filter_files_extensions, filter_files_content_types
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from folder_paths import map_legacy, filter_files_content_types
+
+ORJSON_IS_AVAILABLE = False
+try:
+    import orjson
+    ORJSON_IS_AVAILABLE = True
+except ImportError:
+    pass
+
+MSGPACK_IS_AVAILABLE = False
+try:
+    import msgpack
+    MSGPACK_IS_AVAILABLE = True
+except ImportError:
+    pass
+
+
+def _json_loads(data):
+    if ORJSON_IS_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _ndjson_line(data) -> bytes:
+    """
+    Compact JSON encoding of data terminated by a newline, for the ndjson download progress stream.
+    """
+    if ORJSON_IS_AVAILABLE:
+        return orjson.dumps(data, option=orjson.OPT_APPEND_NEWLINE)
+    return json.dumps(data, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def _json_response(data, headers: dict[str, str] | None = None) -> web.Response:
+    """
+    web.json_response, but encoded with orjson when it is installed. Used for the large model list responses.
+    """
+    if not ORJSON_IS_AVAILABLE:
+        return web.json_response(data, headers=headers)
+    return web.Response(body=orjson.dumps(data), content_type="application/json", headers=headers)
+
+
+def _prefers_msgpack(accept: str) -> bool:
+    """
+    Whether an Accept header asks for application/x-msgpack at least as strongly as for JSON. Wildcards only
+    count towards JSON, so clients have to name msgpack explicitly to get it.
+    """
+    msgpack_q = 0.0
+    json_q = 1.0 if not accept.strip() else 0.0
+    for media_range in accept.split(","):
+        media_type, *params = media_range.split(";")
+        media_type = media_type.strip().lower()
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if media_type == "application/x-msgpack":
+            msgpack_q = max(msgpack_q, q)
+        elif media_type in ("application/json", "application/*", "*/*"):
+            json_q = max(json_q, q)
+    return msgpack_q > 0 and msgpack_q >= json_q
+
+
+def _model_files_with_index(entries) -> list[dict]:
+    """
+    Flattens `(root, path index, cache entry)` triples into the file infos sent to clients. The index is added
+    here instead of being cached, since the same root can sit at different indices in different folder types.
+    """
+    return [
+        {**file_info, "pathIndex": path_index}
+        for _root, path_index, (files_by_dir, _dirs, _root_mtime) in entries
+        for file_info in itertools.chain.from_iterable(files_by_dir.values())
+    ]
+
+
+def _model_list_etag(entries, variant: str) -> str:
+    """
+    The cache entries change whenever a directory below one of the roots changes, so their
+    mtimes identify the model listing without looking at the files.
+    """
+    signature = hashlib.blake2b(variant.encode("utf-8"), digest_size=8)
+    for root, path_index, (files_by_dir, dirs, root_mtime) in entries:
+        file_count = sum(len(files) for files in files_by_dir.values())
+        signature.update(f"{root}:{path_index}:{root_mtime}:{len(dirs)}:{sum(dirs.values())}:{file_count}".encode("utf-8"))
+    return signature.hexdigest()
+
+
+# Preview image files, and the subset of them that is sent to the browser without re-encoding
+_IMAGE_EXTS = frozenset({".png", ".jpg", ".jpeg", ".webp", ".gif", ".bmp"})
+_WEB_IMAGE_EXTS = frozenset({".png", ".jpg", ".jpeg", ".webp"})
+
+
+def _encode_webp(image: str | BytesIO) -> bytes:
+    with Image.open(image) as img:
+        img_bytes = BytesIO()
+        # method=0 is the fastest libwebp encoder setting
+        img.save(img_bytes, format="WEBP", method=0, quality=80)
+        return img_bytes.getvalue()
+
+
+@functools.lru_cache(maxsize=32)
+def _encode_webp_file(path: str, mtime_ns: int, size: int) -> bytes:
+    """
+    WEBP version of a preview file in a format browsers can't show, encoded once per file version.
+    """
+    return _encode_webp(path)
+
+
+def _image_content_type(data: bytes) -> str | None:
+    """
+    Detect browser friendly image formats from their magic bytes.
+    """
+    header = data[:12]
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if header.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+_ALLOWED_SOURCES = ("https://civitai.com/", "https://huggingface.co/", "http://localhost:")
+_WHITELISTED_URLS = frozenset({
+    "https://huggingface.co/stabilityai/stable-zero123/resolve/main/stable_zero123.ckpt",
+    "https://huggingface.co/TencentARC/T2I-Adapter/resolve/main/models/t2iadapter_depth_sd14v1.pth?download=true",
+    "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.0/RealESRGAN_x4plus.pth",
+})
+# Seconds between download progress lines
+_PROGRESS_INTERVAL = 0.25
+# Concurrent downloads allowed per host, to stay clear of the model hosts' rate limits
+_MAX_DOWNLOADS_PER_HOST = 4
+
+_EXCLUDED_DIR_NAMES = frozenset({".git", "__pycache__", ".ipynb_checkpoints"})
+_FOLDER_BLACK_LIST = frozenset({"configs", "custom_nodes"})
+# TODO use settings
+_INCLUDE_HIDDEN_FILES = False
+
+
+def _configured_model_roots() -> set[str]:
+    return {os.path.normpath(path) for paths, _exts in folder_paths.folder_names_and_paths.values() for path in paths}
+
+
+def _drop_model_subtree(path: str, files_by_dir: dict[str, list[dict]], dirs: dict[str, float]):
+    prefix = os.path.join(path, "")
+    for cached in (files_by_dir, dirs):
+        for key in [k for k in cached if k == path or k.startswith(prefix)]:
+            del cached[key]
+
+
+@functools.lru_cache(maxsize=16)
+def _sorted_dir_names(dirname: str, mtime_ns: int) -> tuple[str, ...]:
+    """
+    Sorted entry names of a directory. Keyed on the directory mtime, which changes whenever an
+    entry is added, removed or renamed, so previews for every model of a large folder cost one
+    listing instead of one per model.
+    """
+    with os.scandir(dirname) as it:
+        return tuple(sorted(entry.name for entry in it))
+
+
+@functools.lru_cache(maxsize=64)
+def _safetensors_cover_image(path: str, mtime_ns: int, size: int) -> bytes | None:
+    """
+    First decoded `ssmd_cover_images` entry of a safetensors file. Only the first one is kept since that is
+    the one shown as the preview. The mtime and size are part of the cache key so a modified file is read again.
+    """
+    header = comfy.utils.safetensors_header(path, max_size=8*1024*1024)
+    if not header:
+        return None
+    safetensors_images = _json_loads(header).get("__metadata__", {}).get("ssmd_cover_images", None)
+    if not safetensors_images:
+        return None
+    images = _json_loads(safetensors_images)
+    if not images:
+        return None
+    return base64.b64decode(images[0])
+
+
+def _sha256_file(path: str) -> str:
+    """
+    SHA-256 of a file on disk. Large files are memory mapped and handed to hashlib in a
+    single call so the whole digest loop runs in C.
+    """
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < 10 * 1024 * 1024:
+            hasher.update(f.read())
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if hasattr(mm, "madvise"):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                hasher.update(mm)
+    return hasher.hexdigest()
+
+
+def _scandir_walk(path: str, excluded_dir_names: frozenset[str], include_hidden_files: bool):
+    """
+    Top-down walk of `path` built on os.scandir, yielding `(dirpath, subdirs, files)`
+    where `subdirs` and `files` are lists of os.DirEntry. Directory symlinks are followed
+    and unreadable directories are skipped, like os.walk(followlinks=True).
+    """
+    # Explicit stack instead of recursion: no nested generators on deep trees
+    stack = [path]
+    while stack:
+        dirpath = stack.pop()
+        subdirs: list[os.DirEntry] = []
+        files: list[os.DirEntry] = []
+        try:
+            with os.scandir(dirpath) as it:
+                for entry in it:
+                    # Hidden and excluded names are dropped before anything is stat'ed
+                    if not include_hidden_files and entry.name.startswith("."):
+                        continue
+                    try:
+                        if entry.is_dir():
+                            if entry.name not in excluded_dir_names:
+                                subdirs.append(entry)
+                        elif entry.is_file():
+                            files.append(entry)
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+
+        yield dirpath, subdirs, files
+
+        stack.extend(entry.path for entry in reversed(subdirs))
 
 
 class ModelFileManager:
     def __init__(self) -> None:
-        self.cache: dict[str, tuple[list[dict], dict[str, float], float]] = {}
-
-    def get_cache(self, key: str, default=None) -> tuple[list[dict], dict[str, float], float] | None:
-        return self.cache.get(key, default)
-
-    def set_cache(self, key: str, value: tuple[list[dict], dict[str, float], float]):
-        self.cache[key] = value
+        # Model root folder -> cache entry, for the roots that are currently configured
+        self.cache: dict[str, tuple[dict[str, list[dict]], dict[str, float], float]] = {}
+        self._session: aiohttp.ClientSession | None = None
+        self._host_semaphores: dict[str, asyncio.Semaphore] = {}
+        self._io_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="model_download")
+        self._walk_pool = ThreadPoolExecutor(max_workers=min(8, (os.cpu_count() or 1) + 4), thread_name_prefix="model_walk")
+        self._cache_lock = threading.Lock()
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """
+        Shared client session for model downloads, so connections to the model hosts are kept alive and reused.
+        Cookies are never stored, so nothing set by a host during one download is sent on another user's download.
+        """
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=32, limit_per_host=8, keepalive_timeout=75, ttl_dns_cache=300),
+                cookie_jar=aiohttp.DummyCookieJar(),
+                timeout=aiohttp.ClientTimeout(total=None, sock_read=60, sock_connect=15),
+            )
+        return self._session
+
+    def host_semaphore_(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc.lower()
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = self._host_semaphores[host] = asyncio.Semaphore(_MAX_DOWNLOADS_PER_HOST)
+        return semaphore
+
+    async def close_session(self, app: web.Application | None = None):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._host_semaphores.clear()
+
+    def get_cache(self, key: str, default=None) -> tuple[dict[str, list[dict]], dict[str, float], float] | None:
+        with self._cache_lock:
+            return self.cache.get(key, default)
+
+    def set_cache(self, key: str, value: tuple[dict[str, list[dict]], dict[str, float], float]):
+        # The cache is bounded by the configured roots rather than a fixed entry count, which the UI would
+        # cycle through with a zero hit rate once there are more roots than entries
+        configured_roots = _configured_model_roots()
+        with self._cache_lock:
+            self.cache[key] = value
+            for stale in [root for root in self.cache if root != key and root not in configured_roots]:
+                del self.cache[stale]
 
     def clear_cache(self):
-        self.cache.clear()
+        with self._cache_lock:
+            self.cache.clear()
 
     def add_routes(self, routes):
         # NOTE: This is an experiment to replace `/models`
         @routes.get("/experiment/models")
         async def get_model_folders(request):
-            model_types = list(folder_paths.folder_names_and_paths.keys())
-            folder_black_list = ["configs", "custom_nodes"]
             output_folders: list[dict] = []
-            for folder in model_types:
-                if folder in folder_black_list:
+            for folder, (paths, _exts) in folder_paths.folder_names_and_paths.items():
+                if folder in _FOLDER_BLACK_LIST:
                     continue
-                output_folders.append({"name": folder, "folders": folder_paths.get_folder_paths(folder)})
-            return web.json_response(output_folders)
+                output_folders.append({"name": folder, "folders": paths[:]})
+            return _json_response(output_folders)
 
         # NOTE: This is an experiment to replace `/models/{folder}`
         @routes.get("/experiment/models/{folder}")
@@ -47,8 +324,19 @@ class ModelFileManager:
             folder = request.match_info.get("folder", None)
             if not folder in folder_paths.folder_names_and_paths:
                 return web.Response(status=404)
-            files = self.get_model_file_list(folder)
-            return web.json_response(files)
+            entries = self.get_model_file_list_entries_(folder)
+            use_msgpack = MSGPACK_IS_AVAILABLE and _prefers_msgpack(request.headers.get("Accept", ""))
+
+            etag = _model_list_etag(entries, "msgpack" if use_msgpack else "json")
+            # The body depends on Accept, so caches must key on it as well
+            if any(tag.value in (etag, "*") for tag in request.if_none_match or ()):
+                return web.Response(status=304, headers={"ETag": f'"{etag}"', "Vary": "Accept"})
+
+            headers = {"ETag": f'"{etag}"', "Cache-Control": "no-cache", "Vary": "Accept"}
+            files = _model_files_with_index(entries)
+            if use_msgpack:
+                return web.Response(body=msgpack.packb(files, use_bin_type=True), content_type="application/x-msgpack", headers=headers)
+            return _json_response(files, headers=headers)
 
         @routes.get("/experiment/models/preview/{folder}/{path_index}/{filename:.*}")
         async def get_model_preview(request):
@@ -68,12 +356,22 @@ class ModelFileManager:
             if default_preview is None or (isinstance(default_preview, str) and not os.path.isfile(default_preview)):
                 return web.Response(status=404)
 
+            # Previews already in a browser friendly format are sent as-is instead of being re-encoded
+            if isinstance(default_preview, str):
+                if os.path.splitext(default_preview)[1].lower() in _WEB_IMAGE_EXTS:
+                    return web.FileResponse(default_preview, headers={"Cache-Control": "public, max-age=3600"})
+                st = os.stat(default_preview)
+                encode = functools.partial(_encode_webp_file, default_preview, st.st_mtime_ns, st.st_size)
+            else:
+                body = default_preview.getvalue()
+                content_type = _image_content_type(body)
+                if content_type is not None:
+                    return web.Response(body=body, content_type=content_type)
+                encode = functools.partial(_encode_webp, default_preview)
+
             try:
-                with Image.open(default_preview) as img:
-                    img_bytes = BytesIO()
-                    img.save(img_bytes, format="WEBP")
-                    img_bytes.seek(0)
-                    return web.Response(body=img_bytes.getvalue(), content_type="image/webp")
+                body = await asyncio.get_running_loop().run_in_executor(None, encode)
+                return web.Response(body=body, content_type="image/webp")
             except:
                 return web.Response(status=404)
 
@@ -85,23 +383,23 @@ class ModelFileManager:
             filename = body.get("filename")
             huggingface_token = body.get("huggingface_token")
             path_index = body.get("path_index", 0)
+            expected_sha256 = body.get("expected_sha256")
 
             if not url or not folder:
                 return web.json_response({"error": "Missing required fields 'url' and 'folder'"}, status=400)
 
+            if expected_sha256 is not None:
+                if not isinstance(expected_sha256, str) or len(expected_sha256) != 64 or any(c not in string.hexdigits for c in expected_sha256):
+                    return web.json_response({"error": "Invalid 'expected_sha256', expected 64 hex characters."}, status=400)
+                expected_sha256 = expected_sha256.lower()
+
             folder = map_legacy(folder)
             if folder not in folder_paths.folder_names_and_paths:
                 return web.json_response({"error": f"Unknown folder '{folder}'"}, status=400)
+            available_paths, folder_extensions = folder_paths.folder_names_and_paths[folder]
 
-            allowed_sources = ["https://civitai.com/", "https://huggingface.co/", "http://localhost:"]
-            whitelisted_urls = {
-                "https://huggingface.co/stabilityai/stable-zero123/resolve/main/stable_zero123.ckpt",
-                "https://huggingface.co/TencentARC/T2I-Adapter/resolve/main/models/t2iadapter_depth_sd14v1.pth?download=true",
-                "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.0/RealESRGAN_x4plus.pth",
-            }
-
-            if url not in whitelisted_urls:
-                if not any(url.startswith(source) for source in allowed_sources):
+            if url not in _WHITELISTED_URLS:
+                if not url.startswith(_ALLOWED_SOURCES):
                     return web.json_response({"error": "Downloads are only allowed from civitai.com or huggingface.co."}, status=400)
 
             if filename:
@@ -116,13 +414,13 @@ class ModelFileManager:
 
             sanitized_name = os.path.basename(normalized_relative)
 
-            if url not in whitelisted_urls:
-                allowed_extensions = {ext.lower() for ext in folder_paths.folder_names_and_paths[folder][1] if ext}
+            if url not in _WHITELISTED_URLS:
+                # folder_names_and_paths can be changed at runtime, so this isn't cached across requests
+                allowed_extensions = frozenset(ext.lower() for ext in folder_extensions if ext)
                 if allowed_extensions and allowed_extensions != {"folder"}:
-                    if not any(sanitized_name.lower().endswith(ext) for ext in allowed_extensions):
+                    if os.path.splitext(sanitized_name)[1].lower() not in allowed_extensions:
                         return web.json_response({"error": f"Only {', '.join(sorted(allowed_extensions))} downloads are allowed."}, status=400)
 
-            available_paths = folder_paths.folder_names_and_paths[folder][0]
             try:
                 path_index = int(path_index)
             except (TypeError, ValueError):
@@ -136,14 +434,15 @@ class ModelFileManager:
                 return web.json_response({"error": "Invalid filename."}, status=400)
 
             os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+            # Written next to the destination so the final rename never has to copy across filesystems
+            part_path = f"{destination_path}.{uuid.uuid4().hex}.part"
 
             headers = {}
             if huggingface_token:
                 headers["Authorization"] = f"Bearer {huggingface_token}"
 
             total_bytes = 0
-            emitted_progress = 0
-            last_emit_bytes = 0
+            last_emit_time = 0.0
 
             async def emit_progress(
                 resp: web.StreamResponse,
@@ -167,193 +466,312 @@ class ModelFileManager:
                     payload["total_bytes"] = total_length
                 if not payload:
                     return
-                await resp.write(json.dumps(payload, separators=(",", ":")).encode("utf-8") + b"\n")
-                await resp.drain()
+                # No drain() here, StreamResponse.write already waits on the transport when its buffer is full
+                await resp.write(_ndjson_line(payload))
 
-            try:
-                timeout = aiohttp.ClientTimeout(total=60 * 60)
-                async with aiohttp.ClientSession(timeout=timeout) as session:
-                    async with session.get(url, headers=headers) as response:
-                        if response.status != 200:
-                            return web.json_response({"error": f"Download failed with status {response.status}"}, status=response.status)
+            stream_response: web.StreamResponse | None = None
+
+            async def prepare_stream() -> web.StreamResponse:
+                nonlocal stream_response
+                if stream_response is None:
+                    stream_response = web.StreamResponse(status=200)
+                    stream_response.content_type = "application/x-ndjson"
+                    await stream_response.prepare(request)
+                return stream_response
 
-                        content_length = response.headers.get("Content-Length")
-                        total_length = int(content_length) if content_length and content_length.isdigit() else None
+            try:
+                session = await self._get_session()
+                host_semaphore = self.host_semaphore_(url)
+                if host_semaphore.locked():
+                    # Start the response now so a download waiting for a free slot shows as queued instead of hanging
+                    await emit_progress(
+                        await prepare_stream(),
+                        message=f"Queued, waiting for other downloads from {urlsplit(url).hostname} to finish",
+                    )
+                async with host_semaphore, session.get(url, headers=headers, read_bufsize=10 * 1024 * 1024) as response:
+                    if response.status != 200:
+                        error = f"Download failed with status {response.status}"
+                        if stream_response is None:
+                            return web.json_response({"error": error}, status=response.status)
+                        await emit_progress(stream_response, error=error)
+                        await stream_response.write_eof()
+                        return stream_response
 
-                        stream_response = web.StreamResponse(status=200)
-                        stream_response.content_type = "application/x-ndjson"
-                        await stream_response.prepare(request)
+                    content_length = response.headers.get("Content-Length")
+                    total_length = int(content_length) if content_length and content_length.isdigit() else None
+
+                    stream_response = await prepare_stream()
+
+                    await emit_progress(
+                        stream_response,
+                        message=f"Downloading to {os.path.relpath(destination_path, target_folder)}",
+                        total_length=total_length,
+                        bytes_written=0,
+                    )
+
+                    replaced = False
+                    try:
+                        loop = asyncio.get_running_loop()
+                        with open(part_path, "wb") as outfile:
+                            async for chunk in response.content.iter_chunked(4 * 1024 * 1024):
+                                # Disk writes run on the io executor so a slow disk doesn't stall the event loop
+                                await loop.run_in_executor(self._io_executor, outfile.write, chunk)
+                                total_bytes += len(chunk)
+
+                                # Progress is reported on a timer so fast links don't flood the stream with lines
+                                now = loop.time()
+                                if now - last_emit_time < _PROGRESS_INTERVAL:
+                                    continue
+                                last_emit_time = now
+                                if total_length:
+                                    await emit_progress(
+                                        stream_response,
+                                        progress=min(total_bytes / total_length, 1.0),
+                                        bytes_written=total_bytes,
+                                        total_length=total_length,
+                                    )
+                                else:
+                                    await emit_progress(
+                                        stream_response,
+                                        bytes_written=total_bytes,
+                                    )
+
+                        if expected_sha256 is not None:
+                            # Hashed after the fact from the page cache, instead of per chunk on the event loop
+                            digest = await loop.run_in_executor(self._io_executor, _sha256_file, part_path)
+                            if digest != expected_sha256:
+                                raise ValueError(f"SHA-256 mismatch: expected {expected_sha256}, got {digest}")
+
+                        os.replace(part_path, destination_path)
+                        replaced = True
 
                         await emit_progress(
                             stream_response,
-                            message=f"Downloading to {os.path.relpath(destination_path, target_folder)}",
+                            progress=1.0,
+                            bytes_written=total_bytes,
                             total_length=total_length,
-                            bytes_written=0,
                         )
-
-                        try:
-                            with open(destination_path, "wb") as outfile:
-                                async for chunk in response.content.iter_chunked(1024 * 1024):
-                                    outfile.write(chunk)
-                                    total_bytes += len(chunk)
-
-                                    if total_length:
-                                        progress = min(total_bytes / total_length, 1.0)
-                                        if progress - emitted_progress >= 0.01:
-                                            emitted_progress = progress
-                                            await emit_progress(
-                                                stream_response,
-                                                progress=progress,
-                                                bytes_written=total_bytes,
-                                                total_length=total_length,
-                                            )
-                                    elif total_bytes - last_emit_bytes >= 1 * 1024 * 1024:
-                                        last_emit_bytes = total_bytes
-                                        await emit_progress(
-                                            stream_response,
-                                            bytes_written=total_bytes,
-                                        )
-
-                            await emit_progress(
-                                stream_response,
-                                progress=1.0,
-                                bytes_written=total_bytes,
-                                total_length=total_length,
-                            )
-                            await stream_response.write(json.dumps({
-                                "message": "Download complete",
-                                "path": destination_path,
-                                "folder": folder,
-                                "filename": normalized_relative,
-                            }, separators=(",", ":")).encode("utf-8") + b"\n")
-                        except Exception as e:
-                            logging.exception("Failed to download model")
-                            if os.path.exists(destination_path):
-                                try:
-                                    os.remove(destination_path)
-                                except OSError:
-                                    pass
-                            await emit_progress(stream_response, error=str(e))
-                        finally:
-                            await stream_response.write_eof()
-
-                        return stream_response
+                        await stream_response.write(_ndjson_line({
+                            "message": "Download complete",
+                            "path": destination_path,
+                            "folder": folder,
+                            "filename": normalized_relative,
+                        }))
+                    except Exception as e:
+                        logging.exception("Failed to download model")
+                        await emit_progress(stream_response, error=str(e))
+                    finally:
+                        # Also runs when the handler is cancelled, e.g. on shutdown, so no partial file is left behind
+                        if not replaced and os.path.exists(part_path):
+                            try:
+                                os.remove(part_path)
+                            except OSError:
+                                pass
+                        await stream_response.write_eof()
+
+                    return stream_response
             except Exception as e:
                 logging.exception("Failed to download model")
-                return web.json_response({"error": str(e)}, status=500)
+                if stream_response is None:
+                    return web.json_response({"error": str(e)}, status=500)
+                # Already streaming the queued message, so the status can't change anymore
+                await emit_progress(stream_response, error=str(e))
+                await stream_response.write_eof()
+                return stream_response
 
     def get_model_file_list(self, folder_name: str):
-        folder_name = map_legacy(folder_name)
-        folders = folder_paths.folder_names_and_paths[folder_name]
-        output_list: list[dict] = []
-
-        for index, folder in enumerate(folders[0]):
-            if not os.path.isdir(folder):
-                continue
-            out = self.cache_model_file_list_(folder)
-            if out is None:
-                out = self.recursive_search_models_(folder, index)
-                self.set_cache(folder, out)
-            output_list.extend(out[0])
+        return _model_files_with_index(self.get_model_file_list_entries_(folder_name))
 
-        return output_list
+    def get_model_file_list_entries_(self, folder_name: str) -> list[tuple[str, int, tuple[dict[str, list[dict]], dict[str, float], float]]]:
+        """
+        Returns `(root, path index, cache entry)` for every existing root of `folder_name`, in configured order.
+        """
+        folder_name = map_legacy(folder_name)
+        paths = folder_paths.folder_names_and_paths[folder_name][0]
+        # Normalized so the cached directory keys line up with the DirEntry paths of the walk, even for roots
+        # configured with a trailing separator
+        roots = [(os.path.normpath(folder), index) for index, folder in enumerate(paths) if os.path.isdir(folder)]
+
+        # A root listed twice is walked once, so no two threads ever update the same cache entry
+        unique_roots = list(dict.fromkeys(folder for folder, _index in roots))
+        if len(unique_roots) > 1:
+            # Roots are often on different drives or network mounts, so walk them concurrently
+            results = dict(zip(unique_roots, self._walk_pool.map(self.walk_or_cache_, unique_roots)))
+        else:
+            results = {folder: self.walk_or_cache_(folder) for folder in unique_roots}
+
+        return [(folder, index, results[folder]) for folder, index in roots]
+
+    def walk_or_cache_(self, folder: str):
+        out = self.cache_model_file_list_(folder)
+        if out is None:
+            out = self.recursive_search_models_(folder)
+            self.set_cache(folder, out)
+        return out
 
     def cache_model_file_list_(self, folder: str):
+        """
+        Returns the cached entry for `folder`, bringing it up to date first. Only the
+        directories whose mtime changed since they were scanned are listed again.
+        """
         model_file_list_cache = self.get_cache(folder)
 
         if model_file_list_cache is None:
             return None
         if not os.path.isdir(folder):
             return None
-        if os.path.getmtime(folder) != model_file_list_cache[1]:
-            return None
-        for x in model_file_list_cache[1]:
-            time_modified = model_file_list_cache[1][x]
-            folder = x
-            if os.path.getmtime(folder) != time_modified:
-                return None
 
+        files_by_dir, dirs, root_mtime = model_file_list_cache
+        changed: list[str] = []
+        current_root_mtime = os.path.getmtime(folder)
+        if current_root_mtime != root_mtime:
+            changed.append(folder)
+        for subdir, time_modified in dirs.items():
+            try:
+                if os.path.getmtime(subdir) != time_modified:
+                    changed.append(subdir)
+            except OSError:
+                changed.append(subdir)
+
+        if len(changed) == 0:
+            return model_file_list_cache
+
+        for path in changed:
+            if path != folder and path not in dirs:
+                # Already dropped along with a removed parent
+                continue
+            self.rescan_model_dir_(folder, path, files_by_dir, dirs)
+
+        model_file_list_cache = (files_by_dir, dirs, current_root_mtime)
+        self.set_cache(folder, model_file_list_cache)
         return model_file_list_cache
 
-    def recursive_search_models_(self, directory: str, pathIndex: int) -> tuple[list[str], dict[str, float], float]:
+    def rescan_model_dir_(self, directory: str, path: str, files_by_dir: dict[str, list[dict]], dirs: dict[str, float]):
+        """
+        Lists `path` again without descending into the subdirectories that are already cached.
+        """
+        try:
+            time_modified = os.path.getmtime(path)
+            batch = next(_scandir_walk(path, _EXCLUDED_DIR_NAMES, _INCLUDE_HIDDEN_FILES), None)
+        except OSError:
+            batch = None
+        if batch is None:
+            _drop_model_subtree(path, files_by_dir, dirs)
+            return
+
+        known_subdirs = {d for d in dirs if os.path.dirname(d) == path}
+        _, subdirs, files = batch
+        files_by_dir[path] = self.model_file_infos_(directory, files)
+        if path != directory:
+            dirs[path] = time_modified
+        for entry in subdirs:
+            if entry.path in known_subdirs:
+                known_subdirs.discard(entry.path)
+            else:
+                try:
+                    dirs[entry.path] = entry.stat().st_mtime
+                except FileNotFoundError:
+                    logging.warning(f"Warning: Unable to access {entry.path}. Skipping this path.")
+                    continue
+                self.search_models_(directory, entry.path, files_by_dir, dirs)
+
+        for removed in known_subdirs:
+            _drop_model_subtree(removed, files_by_dir, dirs)
+
+    def recursive_search_models_(self, directory: str) -> tuple[dict[str, list[dict]], dict[str, float], float]:
+        """
+        Returns `(files_by_dir, subdir_mtimes, root_mtime)`, which is also the layout of the cache entries.
+        """
         if not os.path.isdir(directory):
-            return [], {}, time.perf_counter()
+            return {}, {}, 0.0
 
-        excluded_dir_names = [".git"]
-        # TODO use settings
-        include_hidden_files = False
+        # Read before walking so a change during the walk invalidates the cache entry
+        root_mtime = os.path.getmtime(directory)
 
-        result: list[str] = []
+        files_by_dir: dict[str, list[dict]] = {}
         dirs: dict[str, float] = {}
+        self.search_models_(directory, directory, files_by_dir, dirs)
 
-        for dirpath, subdirs, filenames in os.walk(directory, followlinks=True, topdown=True):
-            subdirs[:] = [d for d in subdirs if d not in excluded_dir_names]
-            if not include_hidden_files:
-                subdirs[:] = [d for d in subdirs if not d.startswith(".")]
-                filenames = [f for f in filenames if not f.startswith(".")]
-
-            filenames = filter_files_extensions(filenames, folder_paths.supported_pt_extensions)
+        return files_by_dir, dirs, root_mtime
 
-            for file_name in filenames:
-                try:
-                    full_path = os.path.join(dirpath, file_name)
-                    relative_path = os.path.relpath(full_path, directory)
-
-                    # Get file metadata
-                    file_info = {
-                        "name": relative_path,
-                        "pathIndex": pathIndex,
-                        "modified": os.path.getmtime(full_path),  # Add modification time
-                        "created": os.path.getctime(full_path),   # Add creation time
-                        "size": os.path.getsize(full_path)        # Add file size
-                    }
-                    result.append(file_info)
-
-                except Exception as e:
-                    logging.warning(f"Warning: Unable to access {file_name}. Error: {e}. Skipping this file.")
-                    continue
+    def search_models_(self, directory: str, path: str, files_by_dir: dict[str, list[dict]], dirs: dict[str, float]):
+        for dirpath, subdirs, files in _scandir_walk(path, _EXCLUDED_DIR_NAMES, _INCLUDE_HIDDEN_FILES):
+            files_by_dir[dirpath] = self.model_file_infos_(directory, files)
 
-            for d in subdirs:
-                path: str = os.path.join(dirpath, d)
+            for entry in subdirs:
                 try:
-                    dirs[path] = os.path.getmtime(path)
+                    dirs[entry.path] = entry.stat().st_mtime
                 except FileNotFoundError:
-                    logging.warning(f"Warning: Unable to access {path}. Skipping this path.")
+                    logging.warning(f"Warning: Unable to access {entry.path}. Skipping this path.")
                     continue
 
-        return result, dirs, time.perf_counter()
+    def model_file_infos_(self, directory: str, files: list[os.DirEntry]) -> list[dict]:
+        result: list[dict] = []
+        # entry.path always starts with `directory` since the walk is rooted there, so slicing gives the relative path
+        prefix_len = len(directory.rstrip(os.sep + (os.altsep or ""))) + 1
+        # str.endswith takes the whole extension tuple at once; hidden files were already dropped by the walk
+        extensions = tuple(folder_paths.supported_pt_extensions)
+        model_files = sorted((entry for entry in files if entry.name.lower().endswith(extensions)), key=lambda entry: entry.name)
+        for entry in model_files:
+            try:
+                # DirEntry caches its stat result, so this is the only stat call for the file.
+                # Symlinks are followed so linked models report the size of the target.
+                st = entry.stat()
+                # No "created" field: st_ctime is the inode change time on Linux, not a creation time
+                file_info = {
+                    "name": entry.path[prefix_len:],
+                    "modified": st.st_mtime,  # Add modification time
+                    "size": st.st_size        # Add file size
+                }
+                result.append(file_info)
 
-    def get_model_previews(self, filepath: str) -> list[str | BytesIO]:
-        dirname = os.path.dirname(filepath)
+            except Exception as e:
+                logging.warning(f"Warning: Unable to access {entry.name}. Error: {e}. Skipping this file.")
+                continue
 
-        if not os.path.exists(dirname):
-            return []
+        return result
 
-        basename = os.path.splitext(filepath)[0]
-        match_files = glob.glob(f"{basename}.*", recursive=False)
-        image_files = filter_files_content_types(match_files, "image")
-        safetensors_file = next(filter(lambda x: x.endswith(".safetensors"), match_files), None)
-        safetensors_metadata = {}
+    def get_model_previews(self, filepath: str) -> list[str | BytesIO]:
+        dirname = os.path.dirname(filepath)
+        base_name = os.path.basename(os.path.splitext(filepath)[0])
+        name_prefix = base_name + "."
+        preview_stems = (base_name, base_name + ".preview")
+        safetensors_file = None
 
         result: list[str | BytesIO] = []
+        unknown_files: list[str] = []
 
-        for filename in image_files:
-            _basename = os.path.splitext(filename)[0]
-            if _basename == basename:
-                result.append(filename)
-            if _basename == f"{basename}.preview":
-                result.append(filename)
+        try:
+            names = _sorted_dir_names(dirname, os.stat(dirname).st_mtime_ns)
+        except OSError:
+            return []
+
+        # Every candidate starts with "<base_name>." so they sit next to each other in the sorted listing
+        for i in range(bisect.bisect_left(names, name_prefix), len(names)):
+            name = names[i]
+            if not name.startswith(name_prefix):
+                break
+            stem, ext = os.path.splitext(name)
+            ext = ext.lower()
+            if stem == base_name and ext == ".safetensors":
+                safetensors_file = os.path.join(dirname, name)
+            elif stem in preview_stems:
+                if ext in _IMAGE_EXTS:
+                    result.append(os.path.join(dirname, name))
+                else:
+                    unknown_files.append(os.path.join(dirname, name))
+
+        # Only files with an unusual extension need a content type lookup
+        result.extend(filter_files_content_types(unknown_files, "image"))
 
         if safetensors_file:
-            safetensors_filepath = os.path.join(dirname, safetensors_file)
-            header = comfy.utils.safetensors_header(safetensors_filepath, max_size=8*1024*1024)
-            if header:
-                safetensors_metadata = json.loads(header)
-        safetensors_images = safetensors_metadata.get("__metadata__", {}).get("ssmd_cover_images", None)
-        if safetensors_images:
-            safetensors_images = json.loads(safetensors_images)
-            for image in safetensors_images:
-                result.append(BytesIO(base64.b64decode(image)))
+            try:
+                st = os.stat(safetensors_file)
+            except OSError:
+                return result
+            image = _safetensors_cover_image(safetensors_file, st.st_mtime_ns, st.st_size)
+            if image is not None:
+                result.append(BytesIO(image))
 
         return result
 
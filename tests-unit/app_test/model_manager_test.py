@@ -1,6 +1,10 @@
 import pytest
+import asyncio
+import aiohttp
 import base64
+import hashlib
 import json
+import os
 import struct
 from io import BytesIO
 from PIL import Image
@@ -22,8 +26,26 @@ def app(model_manager):
     routes = web.RouteTableDef()
     model_manager.add_routes(routes)
     app.add_routes(routes)
+    app.on_cleanup.append(model_manager.close_session)
     return app
 
+@pytest.fixture
+def download_source(aiohttp_server, tmp_path):
+    """
+    Starts a local model source answering every path with `handler` and returns its base URL.
+    `tmp_path` is registered as 'test_folder' accepting .safetensors downloads.
+    """
+    async def start(handler) -> str:
+        source = web.Application()
+        source.router.add_get('/{name}', handler)
+        server = await aiohttp_server(source)
+        return f'http://localhost:{server.port}'
+
+    with patch('folder_paths.folder_names_and_paths', {
+        'test_folder': ([str(tmp_path)], {'.safetensors'})
+    }):
+        yield start
+
 async def test_get_model_preview_safetensors(aiohttp_client, app, tmp_path):
     img = Image.new('RGB', (100, 100), 'white')
     img_byte_arr = BytesIO()
@@ -48,15 +70,346 @@ async def test_get_model_preview_safetensors(aiohttp_client, app, tmp_path):
         client = await aiohttp_client(app)
         response = await client.get('/experiment/models/preview/test_folder/0/test_model.safetensors')
 
-        # Verify response
+        # Verify response, embedded images are served without re-encoding
         assert response.status == 200
-        assert response.content_type == 'image/webp'
+        assert response.content_type == 'image/png'
 
         # Verify the response contains valid image data
         img_bytes = BytesIO(await response.read())
         img = Image.open(img_bytes)
         assert img.format
-        assert img.format.lower() == 'webp'
+        assert img.format.lower() == 'png'
 
         # Clean up
         img.close()
+
+async def test_get_model_preview_image_file(aiohttp_client, app, tmp_path):
+    (tmp_path / "test_model.safetensors").write_bytes(struct.pack('<Q', 2) + b"{}")
+    Image.new('RGB', (100, 100), 'white').save(tmp_path / "test_model.preview.jpeg", format='JPEG')
+    Image.new('RGB', (100, 100), 'white').save(tmp_path / "other_model.tiff", format='TIFF')
+
+    with patch('folder_paths.folder_names_and_paths', {
+        'test_folder': ([str(tmp_path)], None)
+    }):
+        client = await aiohttp_client(app)
+        response = await client.get('/experiment/models/preview/test_folder/0/test_model.safetensors')
+        assert response.status == 200
+        assert response.content_type == 'image/jpeg'
+        assert await response.read() == (tmp_path / "test_model.preview.jpeg").read_bytes()
+
+        response = await client.get('/experiment/models/preview/test_folder/0/other_model.safetensors')
+        assert response.status == 200
+        assert response.content_type == 'image/webp'
+
+async def test_get_model_previews_new_file(model_manager, tmp_path):
+    model = tmp_path / "test_model.safetensors"
+    model.write_bytes(struct.pack('<Q', 2) + b"{}")
+    assert model_manager.get_model_previews(str(model)) == []
+
+    Image.new('RGB', (10, 10), 'white').save(tmp_path / "test_model.png", format='PNG')
+    # Make sure the directory mtime moves even on filesystems with coarse timestamps
+    os.utime(tmp_path, ns=(0, os.stat(tmp_path).st_mtime_ns + 1))
+    assert model_manager.get_model_previews(str(model)) == [str(tmp_path / "test_model.png")]
+
+async def test_download_model(aiohttp_client, app, download_source, tmp_path):
+    payload = os.urandom(3 * 1024 * 1024 + 17)
+
+    async def serve_model(request):
+        return web.Response(body=payload)
+
+    base_url = await download_source(serve_model)
+    client = await aiohttp_client(app)
+    response = await client.post('/models/download', json={
+        'url': f'{base_url}/model.safetensors',
+        'folder': 'test_folder',
+    })
+    assert response.status == 200
+    messages = [json.loads(line) for line in (await response.text()).splitlines()]
+    assert messages[-1]['message'] == 'Download complete'
+    assert messages[-2]['bytes'] == len(payload)
+    assert (tmp_path / 'model.safetensors').read_bytes() == payload
+
+    response = await client.post('/models/download', json={
+        'url': f'{base_url}/model.exe',
+        'folder': 'test_folder',
+    })
+    assert response.status == 400
+
+async def test_download_model_sha256(aiohttp_client, app, download_source, tmp_path):
+    payload = os.urandom(11 * 1024 * 1024)
+
+    async def serve_model(request):
+        return web.Response(body=payload)
+
+    url = f'{await download_source(serve_model)}/model.safetensors'
+    client = await aiohttp_client(app)
+
+    response = await client.post('/models/download', json={
+        'url': url, 'folder': 'test_folder', 'expected_sha256': hashlib.sha256(payload).hexdigest().upper(),
+    })
+    messages = [json.loads(line) for line in (await response.text()).splitlines()]
+    assert messages[-1]['message'] == 'Download complete'
+    assert (tmp_path / 'model.safetensors').read_bytes() == payload
+
+    response = await client.post('/models/download', json={
+        'url': url, 'folder': 'test_folder', 'filename': 'other.safetensors', 'expected_sha256': '0' * 64,
+    })
+    messages = [json.loads(line) for line in (await response.text()).splitlines()]
+    assert 'SHA-256 mismatch' in messages[-1]['error']
+    assert not (tmp_path / 'other.safetensors').exists()
+    assert not list(tmp_path.glob('*.part'))
+
+    response = await client.post('/models/download', json={
+        'url': url, 'folder': 'test_folder', 'expected_sha256': 'not a hash',
+    })
+    assert response.status == 400
+
+async def test_download_model_cancelled(aiohttp_client, app, download_source, tmp_path):
+    async def serve_model(request):
+        return web.Response(body=b"1234")
+
+    def cancel(path):
+        raise asyncio.CancelledError()
+
+    base_url = await download_source(serve_model)
+    client = await aiohttp_client(app)
+    with patch('app.model_manager._sha256_file', cancel):
+        try:
+            response = await client.post('/models/download', json={
+                'url': f'{base_url}/model.safetensors',
+                'folder': 'test_folder',
+                'expected_sha256': '0' * 64,
+            })
+            await response.read()
+        except aiohttp.ClientError:
+            pass
+
+    assert list(tmp_path.iterdir()) == []
+
+async def test_download_model_queued(aiohttp_client, app, download_source, tmp_path):
+    release = asyncio.Event()
+
+    async def serve_model(request):
+        response = web.StreamResponse()
+        await response.prepare(request)
+        await release.wait()
+        await response.write(b"1234")
+        return response
+
+    base_url = await download_source(serve_model)
+    client = await aiohttp_client(app)
+    with patch('app.model_manager._MAX_DOWNLOADS_PER_HOST', 1):
+        try:
+            first = await client.post('/models/download', json={
+                'url': f'{base_url}/a.safetensors', 'folder': 'test_folder',
+            })
+            assert 'Downloading to' in json.loads(await first.content.readline())['message']
+
+            # The second download to the same host waits for the first, but its response starts right away
+            second = await asyncio.wait_for(client.post('/models/download', json={
+                'url': f'{base_url}/b.safetensors', 'folder': 'test_folder',
+            }), timeout=5)
+            assert second.status == 200
+            assert json.loads(await asyncio.wait_for(second.content.readline(), timeout=5))['message'].startswith('Queued')
+        finally:
+            release.set()
+
+        for response in (first, second):
+            messages = [json.loads(line) for line in (await response.text()).splitlines()]
+            assert messages[-1]['message'] == 'Download complete'
+    assert (tmp_path / 'b.safetensors').read_bytes() == b"1234"
+
+async def test_download_model_no_cookies(aiohttp_client, app, download_source):
+    cookie_headers = []
+
+    async def serve_model(request):
+        cookie_headers.append(request.headers.get('Cookie'))
+        response = web.Response(body=b"1234")
+        response.set_cookie('session', 'secret-user-A')
+        return response
+
+    base_url = await download_source(serve_model)
+    client = await aiohttp_client(app)
+    for name in ('a.safetensors', 'b.safetensors'):
+        response = await client.post('/models/download', json={
+            'url': f'{base_url}/{name}',
+            'folder': 'test_folder',
+        })
+        messages = [json.loads(line) for line in (await response.text()).splitlines()]
+        assert messages[-1]['message'] == 'Download complete'
+
+    assert cookie_headers == [None, None]
+
+async def test_get_all_models(aiohttp_client, app, tmp_path):
+    (tmp_path / "a.safetensors").write_bytes(b"1234")
+
+    with patch('folder_paths.folder_names_and_paths', {
+        'test_folder': ([str(tmp_path)], None)
+    }):
+        client = await aiohttp_client(app)
+        response = await client.get('/experiment/models/test_folder')
+        assert response.status == 200
+        assert response.content_type == 'application/json'
+        files = await response.json()
+        assert [(f["name"], f["pathIndex"], f["size"]) for f in files] == [("a.safetensors", 0, 4)]
+
+        response = await client.get('/experiment/models/unknown_folder')
+        assert response.status == 404
+
+async def test_get_all_models_etag(aiohttp_client, app, tmp_path):
+    (tmp_path / "a.safetensors").write_bytes(b"")
+
+    with patch('folder_paths.folder_names_and_paths', {
+        'test_folder': ([str(tmp_path)], None)
+    }):
+        client = await aiohttp_client(app)
+        response = await client.get('/experiment/models/test_folder')
+        assert response.status == 200
+        etag = response.headers['ETag']
+
+        response = await client.get('/experiment/models/test_folder', headers={'If-None-Match': etag})
+        assert response.status == 304
+
+        response = await client.get('/experiment/models/test_folder', headers={'If-None-Match': '*'})
+        assert response.status == 304
+
+        (tmp_path / "b.safetensors").write_bytes(b"")
+        os.utime(tmp_path, (0, 0))
+        response = await client.get('/experiment/models/test_folder', headers={'If-None-Match': etag})
+        assert response.status == 200
+        assert response.headers['ETag'] != etag
+        assert len(await response.json()) == 2
+
+async def test_get_all_models_msgpack(aiohttp_client, app, tmp_path):
+    msgpack = pytest.importorskip("msgpack")
+    (tmp_path / "a.safetensors").write_bytes(b"1234")
+
+    with patch('folder_paths.folder_names_and_paths', {
+        'test_folder': ([str(tmp_path)], None)
+    }):
+        client = await aiohttp_client(app)
+        response = await client.get('/experiment/models/test_folder', headers={'Accept': 'application/x-msgpack'})
+        assert response.status == 200
+        assert response.content_type == 'application/x-msgpack'
+        files = msgpack.unpackb(await response.read())
+        assert [(f["name"], f["size"]) for f in files] == [("a.safetensors", 4)]
+        assert response.headers['Vary'] == 'Accept'
+
+        response = await client.get('/experiment/models/test_folder', headers={'If-None-Match': response.headers['ETag'], 'Accept': 'application/x-msgpack'})
+        assert response.status == 304
+        assert response.headers['Vary'] == 'Accept'
+
+        for accept in ('application/x-msgpack;q=0', 'application/json, application/x-msgpack;q=0.5', '*/*'):
+            response = await client.get('/experiment/models/test_folder', headers={'Accept': accept})
+            assert response.content_type == 'application/json'
+            assert response.headers['Vary'] == 'Accept'
+
+        response = await client.get('/experiment/models/test_folder', headers={'Accept': 'application/json;q=0.9, application/x-msgpack'})
+        assert response.content_type == 'application/x-msgpack'
+
+async def test_model_file_list_multiple_roots(model_manager, tmp_path):
+    roots = [tmp_path / "first", tmp_path / "missing", tmp_path / "second"]
+    roots[0].mkdir()
+    roots[2].mkdir()
+    (roots[0] / "a.safetensors").write_bytes(b"")
+    (roots[2] / "b.safetensors").write_bytes(b"")
+
+    with patch('folder_paths.folder_names_and_paths', {
+        'test_folder': ([str(r) for r in roots], None)
+    }):
+        files = model_manager.get_model_file_list('test_folder')
+        assert [(f["name"], f["pathIndex"]) for f in files] == [("a.safetensors", 0), ("b.safetensors", 2)]
+
+async def test_model_file_list_shared_root(model_manager, tmp_path):
+    shared, other = tmp_path / "shared", tmp_path / "other"
+    shared.mkdir()
+    other.mkdir()
+    (shared / "x.safetensors").write_bytes(b"")
+    (shared / "sub").mkdir()
+
+    with patch('folder_paths.folder_names_and_paths', {
+        'a': ([str(shared)], None),
+        'b': ([str(other), str(shared)], None),
+        'c': ([str(shared), str(shared) + os.sep], None),
+    }):
+        assert [(f["name"], f["pathIndex"]) for f in model_manager.get_model_file_list('a')] == [("x.safetensors", 0)]
+        assert [(f["name"], f["pathIndex"]) for f in model_manager.get_model_file_list('b')] == [("x.safetensors", 1)]
+
+        # Rescanning a changed directory keeps the index of every listing consistent
+        (shared / "sub" / "y.safetensors").write_bytes(b"")
+        os.utime(shared / "sub", (0, 0))
+        files = model_manager.get_model_file_list('c')
+        assert sorted((f["name"], f["pathIndex"]) for f in files) == [
+            ("sub" + os.sep + "y.safetensors", 0), ("sub" + os.sep + "y.safetensors", 1), ("x.safetensors", 0), ("x.safetensors", 1),
+        ]
+        assert {f["pathIndex"] for f in model_manager.get_model_file_list('b')} == {1}
+
+async def test_model_file_list_cache(model_manager, tmp_path):
+    subdir = tmp_path / "sub"
+    subdir.mkdir()
+    (tmp_path / "a.safetensors").write_bytes(b"")
+    (subdir / "b.safetensors").write_bytes(b"")
+
+    with patch('folder_paths.folder_names_and_paths', {
+        'test_folder': ([str(tmp_path)], None)
+    }):
+        files = model_manager.get_model_file_list('test_folder')
+        assert sorted(f["name"] for f in files) == ["a.safetensors", os.path.join("sub", "b.safetensors")]
+
+        cached = model_manager.get_cache(str(tmp_path))
+        assert model_manager.cache_model_file_list_(str(tmp_path)) is cached
+
+        # Only the changed directory is listed again
+        (subdir / "c.safetensors").write_bytes(b"")
+        os.utime(subdir, (0, 0))
+        files = model_manager.get_model_file_list('test_folder')
+        assert len(files) == 3
+
+        nested = subdir / "nested"
+        nested.mkdir()
+        (nested / "d.safetensors").write_bytes(b"")
+        files = model_manager.get_model_file_list('test_folder')
+        assert os.path.join("sub", "nested", "d.safetensors") in [f["name"] for f in files]
+
+        for f in nested.iterdir():
+            f.unlink()
+        nested.rmdir()
+        (subdir / "b.safetensors").unlink()
+        (subdir / "c.safetensors").unlink()
+        subdir.rmdir()
+        files = model_manager.get_model_file_list('test_folder')
+        assert [f["name"] for f in files] == ["a.safetensors"]
+        assert model_manager.get_cache(str(tmp_path))[1] == {}
+
+async def test_model_file_list_cache_trailing_separator(model_manager, tmp_path):
+    subdir = tmp_path / "sub"
+    subdir.mkdir()
+    (subdir / "b.safetensors").write_bytes(b"")
+
+    with patch('folder_paths.folder_names_and_paths', {
+        'test_folder': ([str(tmp_path) + os.sep], None)
+    }):
+        assert len(model_manager.get_model_file_list('test_folder')) == 1
+
+        # A change at the root lists the root again, without walking the cached subdirectories
+        (tmp_path / "a.safetensors").write_bytes(b"")
+        os.utime(tmp_path, (0, 0))
+        with patch.object(model_manager, 'search_models_', wraps=model_manager.search_models_) as search_models:
+            files = model_manager.get_model_file_list('test_folder')
+        search_models.assert_not_called()
+        assert sorted(f["name"] for f in files) == ["a.safetensors", os.path.join("sub", "b.safetensors")]
+
+async def test_model_file_list_cache_drops_unconfigured_roots(model_manager, tmp_path):
+    with patch('folder_paths.folder_names_and_paths', {
+        'a': ([str(tmp_path / "a")], None),
+        'b': ([str(tmp_path / "b"), str(tmp_path / "c")], None),
+    }):
+        for root in ("a", "b", "c"):
+            model_manager.set_cache(str(tmp_path / root), ({}, {}, 0.0))
+        assert len(model_manager.cache) == 3
+
+    with patch('folder_paths.folder_names_and_paths', {
+        'b': ([str(tmp_path / "b")], None),
+    }):
+        model_manager.set_cache(str(tmp_path / "b"), ({}, {}, 0.0))
+        assert list(model_manager.cache.keys()) == [str(tmp_path / "b")]